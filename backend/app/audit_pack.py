@@ -0,0 +1,267 @@
+"""Audit pack: the CBAM report PDF followed by every uploaded invoice of the period.
+
+The pack is written object by object (``_PackWriter``): each source PDF is opened
+with pikepdf, the objects its pages reach are renumbered and written straight to the
+output file, and the source is closed before the next one is opened. Only one source
+is open at a time and memory holds that source's object table, its largest stream and
+the xref offsets, however many invoices the period has. (Copying pages between
+pikepdf ``Pdf`` objects would not do: qpdf buffers every copied stream in memory.)
+
+Packs are cached by content key. Serving a cached pack refreshes its mtime, and
+pruning only removes packs untouched for ``PRUNE_GRACE_S``, so a pack that another
+worker is still sending is never deleted under it.
+"""
+import os
+import time
+import glob
+import shutil
+import hashlib
+from decimal import Decimal
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+import pikepdf
+
+from .models import Period, Upload, PeriodVersion
+
+KIND_TITLES = [
+    ("electricity", "Elektrik faturaları"),
+    ("gas", "Doğalgaz faturaları"),
+    ("evidence", "Destek dokümanları"),
+]
+PACK_FORMAT = 2
+PRUNE_GRACE_S = int(os.getenv("AUDIT_PACK_PRUNE_GRACE", "900"))
+
+def _file_sha256(path: str) -> Optional[str]:
+    try:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    except OSError:
+        return None
+
+def upload_hash(up: Upload) -> Optional[str]:
+    return up.sha256 or _file_sha256(up.stored_path)
+
+def pack_key(version: PeriodVersion, uploads: List[Upload]) -> str:
+    """Content key: the period snapshot plus the hash of every upload, in pack order."""
+    h = hashlib.sha256(f"v{PACK_FORMAT}:{version.installation_hash}:{version.energy_hash}:{version.products_hash}".encode())
+    for up in uploads:
+        h.update(f"|{up.id}:{up.kind}:{up.original_name}:{upload_hash(up)}".encode("utf-8"))
+    return h.hexdigest()
+
+def ordered_uploads(uploads: List[Upload]) -> List[Upload]:
+    order = {k: i for i, (k, _) in enumerate(KIND_TITLES)}
+    return sorted(uploads, key=lambda u: (order.get(u.kind, len(order)), u.uploaded_at or datetime.min, u.id))
+
+def _kind_title(kind: str) -> str:
+    return dict(KIND_TITLES).get(kind, f"Diğer ({kind})")
+
+def _page_count(path: str) -> int:
+    with pikepdf.open(path) as pdf:
+        return len(pdf.pages)
+
+def build_audit_pack(out_path: str, period: Period, uploads: List[Upload],
+                     build_report: Callable[[str], str], build_index: Callable[[str, Period, int, List[dict]], str]) -> str:
+    work = out_path + ".parts"
+    os.makedirs(work, exist_ok=True)
+    try:
+        return _build(out_path, work, period, uploads, build_report, build_index)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def _build(out_path: str, work: str, period: Period, uploads: List[Upload], build_report, build_index) -> str:
+    report_path = build_report(os.path.join(work, "report.pdf"))
+    report_pages = _page_count(report_path)
+
+    entries = []
+    for up in ordered_uploads(uploads):
+        e = {"upload": up, "kind": up.kind, "kind_title": _kind_title(up.kind), "name": up.original_name,
+             "sha256": upload_hash(up), "pages": 0, "start_page": None, "note": ""}
+        if not os.path.exists(up.stored_path):
+            e["note"] = "dosya bulunamadı"
+        elif not up.stored_path.lower().endswith(".pdf"):
+            e["note"] = "PDF değil, eklenmedi"
+        else:
+            try:
+                e["pages"] = _page_count(up.stored_path)
+            except Exception:
+                e["note"] = "okunamadı"
+        entries.append(e)
+
+    # the index is drawn twice: once to learn its own length, then with final page numbers
+    index_path = os.path.join(work, "index.pdf")
+    build_index(index_path, period, report_pages, entries)
+    page = report_pages + _page_count(index_path) + 1
+    for e in entries:
+        if e["pages"]:
+            e["start_page"] = page
+            page += e["pages"]
+    build_index(index_path, period, report_pages, entries)
+
+    with open(out_path, "wb") as f:
+        pack = _PackWriter(f)
+        outline = [("CBAM Raporu", pack.append(report_path), []),
+                   ("Ek Dizini", pack.append(index_path), [])]
+        parents = {}
+        for e in entries:
+            if not e["pages"]:
+                continue
+            start = pack.append(e["upload"].stored_path)
+            if e["kind_title"] not in parents:
+                parents[e["kind_title"]] = (e["kind_title"], start, [])
+                outline.append(parents[e["kind_title"]])
+            parents[e["kind_title"]][2].append((e["name"], start, []))
+        pack.close(outline)
+    return out_path
+
+class _PackWriter:
+    """Streams a merged PDF to ``f``, copying the pages of one source file at a time."""
+
+    INHERITED = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = [0, 0]  # catalog and page tree are written by close()
+        self.pages: List[int] = []
+        f.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def _alloc(self) -> int:
+        self.offsets.append(0)
+        return len(self.offsets)
+
+    def _write(self, num: int, body: bytes, data: Optional[bytes] = None):
+        self.offsets[num - 1] = self.f.tell()
+        self.f.write(b"%d 0 obj\n" % num + body)
+        if data is not None:
+            self.f.write(b"\nstream\n" + data + b"\nendstream")
+        self.f.write(b"\nendobj\n")
+
+    def append(self, path: str) -> int:
+        """Copy every page of ``path``; returns the pack index of its first page."""
+        start = len(self.pages)
+        with pikepdf.open(path) as src:
+            nums, queue = {}, []
+
+            def ref(obj) -> bytes:
+                if obj.objgen not in nums:
+                    nums[obj.objgen] = self._alloc()
+                    queue.append(obj)
+                return b"%d 0 R" % nums[obj.objgen]
+
+            def value(v) -> bytes:
+                if v is None:
+                    return b"null"
+                if isinstance(v, bool):
+                    return b"true" if v else b"false"
+                if isinstance(v, int):
+                    return b"%d" % v
+                if isinstance(v, (Decimal, float)):
+                    return format(Decimal(v), "f").encode()
+                if isinstance(v, (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream)) and v.is_indirect:
+                    return ref(v)
+                return body(v)
+
+            def entries(d, skip=()) -> bytes:
+                return b"".join(pikepdf.Name(k).unparse() + b" " + value(v) + b"\n"
+                                for k, v in d.items() if k not in skip)
+
+            def body(v) -> bytes:
+                if isinstance(v, pikepdf.Dictionary):
+                    return b"<<" + entries(v) + b">>"
+                if isinstance(v, pikepdf.Array):
+                    return b"[" + b" ".join(value(x) for x in v) + b"]"
+                return v.unparse(resolved=True)
+
+            # page objects get their numbers first so links and annotations that point
+            # at a page resolve to the copy instead of dragging the source page tree in
+            page_objs = [page.obj for page in src.pages]
+            for obj in page_objs:
+                nums[obj.objgen] = self._alloc()
+            for obj in page_objs:
+                # the copy has a new parent, so attributes it inherited move onto the page
+                extra = b""
+                for k in self.INHERITED:
+                    inherited = None if k in obj else _inherited(obj, k)
+                    if inherited is not None:
+                        extra += pikepdf.Name(k).unparse() + b" " + value(inherited) + b"\n"
+                num = nums[obj.objgen]
+                self._write(num, b"<<" + entries(obj, skip=("/Parent",)) + extra + b"/Parent 2 0 R>>")
+                self.pages.append(num)
+                while queue:
+                    o = queue.pop()
+                    if isinstance(o, pikepdf.Stream):
+                        data = o.read_raw_bytes()
+                        self._write(nums[o.objgen], b"<<" + entries(o.stream_dict, skip=("/Length",))
+                                    + b"/Length %d>>" % len(data), data)
+                    else:
+                        self._write(nums[o.objgen], body(o))
+        return start
+
+    def _outline(self, items, parent: int) -> Tuple[int, int, int]:
+        """Write one outline level; returns (first, last, count) for the parent."""
+        nums = [self._alloc() for _ in items]
+        count = len(items)
+        for i, (title, page, children) in enumerate(items):
+            d = b"/Title " + pikepdf.String(title).unparse() + b"\n/Parent %d 0 R\n" % parent
+            d += b"/Dest [%d 0 R /Fit]\n" % self.pages[page]
+            if i:
+                d += b"/Prev %d 0 R\n" % nums[i - 1]
+            if i < len(items) - 1:
+                d += b"/Next %d 0 R\n" % nums[i + 1]
+            if children:
+                first, last, n = self._outline(children, nums[i])
+                d += b"/First %d 0 R\n/Last %d 0 R\n/Count %d\n" % (first, last, n)
+                count += n
+            self._write(nums[i], b"<<" + d + b">>")
+        return nums[0], nums[-1], count
+
+    def close(self, outline):
+        """Write bookmarks ``[(title, page index, children)]``, page tree, catalog and xref."""
+        catalog = b"/Type /Catalog\n/Pages 2 0 R\n"
+        if outline:
+            root = self._alloc()
+            first, last, count = self._outline(outline, root)
+            self._write(root, b"<</Type /Outlines\n/First %d 0 R\n/Last %d 0 R\n/Count %d>>" % (first, last, count))
+            catalog += b"/Outlines %d 0 R\n/PageMode /UseOutlines\n" % root
+        kids = b" ".join(b"%d 0 R" % n for n in self.pages)
+        self._write(self.PAGES, b"<</Type /Pages\n/Kids [" + kids + b"]\n/Count %d>>" % len(self.pages))
+        self._write(self.CATALOG, b"<<" + catalog + b">>")
+        xref = self.f.tell()
+        self.f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.offsets) + 1))
+        self.f.writelines(b"%010d 00000 n \n" % off for off in self.offsets)
+        self.f.write(b"trailer\n<</Size %d\n/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (len(self.offsets) + 1, xref))
+
+def _inherited(page, key: str):
+    node = page.get("/Parent")
+    for _ in range(64):  # guards against a cyclic page tree
+        if node is None:
+            return None
+        if key in node:
+            return node[key]
+        node = node.get("/Parent")
+    return None
+
+def cached_pack_path(pack_dir: str, period_id: int, key: str) -> str:
+    return os.path.join(pack_dir, f"P{period_id}_{key[:20]}.pdf")
+
+def touch_pack(path: str) -> bool:
+    """Mark a cached pack as in use; False if it does not exist (yet)."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def prune_packs(pack_dir: str, period_id: int, keep: str, grace_s: int = PRUNE_GRACE_S):
+    cutoff = time.time() - grace_s
+    for p in glob.glob(os.path.join(pack_dir, f"P{period_id}_*.pdf")):
+        if p == keep:
+            continue
+        try:
+            if os.path.getmtime(p) < cutoff:
+                os.remove(p)
+        except OSError:
+            pass
@@ -0,0 +1,48 @@
+"""One-time schema/seed step shared by every worker and every replica.
+
+Run it once before the workers start (``python -m app.bootstrap`` or the gunicorn
+``on_starting`` hook); each app process calls it again on startup, but the file lock
+serialises them so concurrent boots no longer race on schema migrations / ``seed_admin``.
+"""
+import os
+import fcntl
+from contextlib import contextmanager
+
+from .db import SessionLocal, engine, DB_PATH
+from .migrations import migrate_schema
+from .models import User
+from .auth import hash_password
+
+LOCK_PATH = os.getenv("BOOTSTRAP_LOCK_PATH", os.path.join(os.path.dirname(DB_PATH), ".bootstrap.lock"))
+
+@contextmanager
+def file_lock(path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def seed_admin(db):
+    admin = db.query(User).filter(User.email == "admin@isotec.local").first()
+    if not admin:
+        admin = User(
+            email="admin@isotec.local",
+            password_hash=hash_password("ChangeMe123!"),
+            full_name="Admin",
+            role="admin",
+        )
+        db.add(admin)
+        db.commit()
+
+def bootstrap():
+    with file_lock(LOCK_PATH):
+        migrate_schema(engine)
+        with SessionLocal() as db:
+            seed_admin(db)
+
+if __name__ == "__main__":
+    bootstrap()
+    print("bootstrap ok")
@@ -1,11 +1,12 @@
 import os
 from datetime import date
-from typing import List, Tuple
+from typing import Iterable
 import openpyxl
 
-from .models import Period, Product
+from .models import Period
+from .product_rows import ProductRow
 
-def fill_cbam_template(template_path: str, period: Period, products: List[Product], out_path: str) -> str:
+def fill_cbam_template(template_path: str, period: Period, products: Iterable[ProductRow], out_path: str) -> str:
     wb = openpyxl.load_workbook(template_path)
 
     # --- A_InstData (installation + reporting period) ---
@@ -33,14 +34,6 @@ def fill_cbam_template(template_path: str, period: Period, products: List[Produc
     wsC["H41"].value = period.default_values_justification
     wsC["H42"].value = period.quality_assurance
 
-    # Total indirect emissions at installation level (manual entry cell M26)
-    total_indirect = 0.0
-    total_direct = 0.0
-    for p in products:
-        total_direct += (p.production_t or 0.0) * (p.direct_see or 0.0)
-        total_indirect += (p.production_t or 0.0) * (p.indirect_see or 0.0)
-    wsC["M26"].value = round(total_indirect, 6)
-
     # --- Summary_Products (direct fill for product lines) ---
     wsS = wb["Summary_Products"]
     start_row = 10
@@ -49,6 +42,9 @@ def fill_cbam_template(template_path: str, period: Period, products: List[Produc
         for col in ["D","E","F","G","H","I","J"]:
             wsS[f"{col}{r}"].value = None
 
+    # single pass over the (streamed) product rows: write lines and accumulate totals
+    total_indirect = 0.0
+    total_direct = 0.0
     for i, p in enumerate(products):
         r = start_row + i
         wsS[f"D{r}"].value = "ISOTEC General process"
@@ -59,6 +55,11 @@ def fill_cbam_template(template_path: str, period: Period, products: List[Produc
         wsS[f"I{r}"].value = p.direct_see
         wsS[f"J{r}"].value = p.indirect_see
         # Total column K is formula; keep as is.
+        total_direct += (p.production_t or 0.0) * (p.direct_see or 0.0)
+        total_indirect += (p.production_t or 0.0) * (p.indirect_see or 0.0)
+
+    # Total indirect emissions at installation level (manual entry cell M26)
+    wsC["M26"].value = round(total_indirect, 6)
 
     wb.save(out_path)
     return out_path
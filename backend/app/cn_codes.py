@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+import openpyxl
+
+# Parameters_CNCodes sheet of the official CBAM communication template:
+# B = CN code ("7610 90 90"), C = description, D = digits-only key, E = CBAM good category
+CN_SHEET = "Parameters_CNCodes"
+CN_FIRST_ROW = 4
+INDEX_VERSION = 1
+
+# (key, code, name, category)
+CNEntry = Tuple[str, str, str, str]
+
+def normalize_cn(code: str) -> str:
+    return "".join(ch for ch in (code or "") if ch.isdigit())
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def extract_cn_entries(template_path: str) -> List[CNEntry]:
+    wb = openpyxl.load_workbook(template_path, read_only=True, data_only=True)
+    try:
+        ws = wb[CN_SHEET]
+        entries: Dict[str, CNEntry] = {}
+        for row in ws.iter_rows(min_row=CN_FIRST_ROW, min_col=2, max_col=5, values_only=True):
+            code, name, key, category = row
+            key = normalize_cn(str(key or code or ""))
+            if not key:
+                continue
+            entries[key] = (key, str(code or key).strip(), str(name or "").strip(), str(category or "").strip())
+    finally:
+        wb.close()
+    return sorted(entries.values())
+
+class CNIndex:
+    """Sorted in-memory CN code list; prefix search is a bisect over the keys."""
+
+    def __init__(self, entries: List[CNEntry], template_sha256: str = ""):
+        self.entries = sorted(entries)
+        self.keys = [e[0] for e in self.entries]
+        self.by_key = {e[0]: e for e in self.entries}
+        self.template_sha256 = template_sha256
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lookup(self, code: str) -> Optional[CNEntry]:
+        return self.by_key.get(normalize_cn(code))
+
+    def prefix(self, q: str, limit: int = 20) -> List[CNEntry]:
+        key = normalize_cn(q)
+        if not key:
+            return self.entries[:limit]
+        out = []
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and len(out) < limit and self.keys[i].startswith(key):
+            out.append(self.entries[i])
+            i += 1
+        return out
+
+def load_cn_index(template_path: str, index_path: str) -> CNIndex:
+    """Load the prebuilt index, rebuilding it only when the template hash changed."""
+    if not os.path.exists(template_path):
+        return CNIndex([])
+    sha = file_sha256(template_path)
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("template_sha256") == sha:
+                return CNIndex([tuple(e) for e in data["entries"]], sha)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    entries = extract_cn_entries(template_path)
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "template_sha256": sha, "entries": entries}, f, ensure_ascii=False)
+    os.replace(tmp, index_path)
+    return CNIndex(entries, sha)
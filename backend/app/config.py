@@ -0,0 +1,10 @@
+import os
+
+APP_SECRET_KEY = os.getenv("APP_SECRET_KEY", "change-me")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/app/data/uploads")
+EXPORT_DIR = os.getenv("EXPORT_DIR", "/app/data/exports")
+AUDIT_PACK_DIR = os.getenv("AUDIT_PACK_DIR", os.path.join(EXPORT_DIR, "audit_packs"))
+SCAN_REPORT_DIR = os.getenv("SCAN_REPORT_DIR", "/app/data/reports")
+TEMPLATE_PATH = os.getenv("CBAM_TEMPLATE_PATH", "/app/data/templates/cbam_template.xlsx")
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", "/app/data/cache/jinja")
+CN_INDEX_PATH = os.getenv("CN_INDEX_PATH", os.path.join(os.path.dirname(TEMPLATE_PATH), "cn_index.json"))
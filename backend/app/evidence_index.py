@@ -0,0 +1,215 @@
+"""Evidence indexer: inventories upload/export folders against ``Upload`` rows.
+
+Replaces the one-off ``folder_scan_report.*`` inventory. The previous JSON report
+doubles as the hash cache, so a rescan only rehashes files whose size or mtime
+changed; those are hashed in parallel from mmap-backed reads.
+
+    python -m app.evidence_index [--out DIR] [--workers N]
+"""
+import os
+import sys
+import csv
+import json
+import mmap
+import uuid
+import hashlib
+from datetime import datetime
+from html import escape
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from sqlalchemy.orm import Session
+
+from .models import Upload
+
+REPORT_NAME = "folder_scan_report"
+REPORT_LIMIT = 200  # rows shown in the md/html reports; json/csv are complete
+HASH_WORKERS = int(os.getenv("EVIDENCE_HASH_WORKERS", str(min(8, (os.cpu_count() or 1) * 2))))
+
+def sha256_mmap(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return h.hexdigest()
+        # hashlib releases the GIL on large buffers, so threads hash files concurrently
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            h.update(m)
+    return h.hexdigest()
+
+def _walk(roots: List[str]) -> Dict[str, os.stat_result]:
+    found = {}
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith(".tmp"):  # in-flight exports
+                    continue
+                p = os.path.abspath(os.path.join(dirpath, name))
+                try:
+                    found[p] = os.stat(p)
+                except OSError:
+                    pass
+    return found
+
+def _load_previous(out_dir: str) -> Dict[str, dict]:
+    try:
+        with open(os.path.join(out_dir, REPORT_NAME + ".json"), "r", encoding="utf-8") as f:
+            return {it["abs_path"]: it for it in json.load(f).get("items", []) if it.get("sha256")}
+    except (OSError, ValueError):
+        return {}
+
+def scan(db: Session, upload_dir: str, roots: List[str], out_dir: str, workers: int = HASH_WORKERS) -> dict:
+    """Index ``roots`` incrementally, reconcile against ``Upload`` rows and write all four reports."""
+    roots = [os.path.abspath(r) for r in roots]
+    target = os.path.commonpath(roots) if roots else ""
+    previous = _load_previous(out_dir)
+    found = _walk(roots)
+
+    items, to_hash = [], []
+    for p, st in sorted(found.items()):
+        item = {
+            "path": os.path.relpath(p, target).replace(os.sep, "/"),
+            "abs_path": p,
+            "size": st.st_size,
+            "mtime": int(st.st_mtime),
+            "mtime_ns": st.st_mtime_ns,
+            "ext": os.path.splitext(p)[1].lower(),
+            "sha256": None,
+            "upload_id": None,
+        }
+        prev = previous.get(p)
+        if prev and prev.get("size") == st.st_size and prev.get("mtime_ns") == st.st_mtime_ns:
+            item["sha256"] = prev["sha256"]
+        else:
+            to_hash.append(item)
+        items.append(item)
+
+    def _hash(item):
+        try:
+            item["sha256"] = sha256_mmap(item["abs_path"])
+        except OSError:
+            item["sha256"] = None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(_hash, to_hash))
+
+    # reconcile with the uploads table
+    by_path = {it["abs_path"]: it for it in items}
+    upload_root = os.path.abspath(upload_dir)
+    missing, mismatched = [], []
+    referenced = set()
+    for up in db.query(Upload.id, Upload.period_id, Upload.kind, Upload.stored_path, Upload.sha256).yield_per(1000):
+        p = os.path.abspath(up.stored_path)
+        referenced.add(p)
+        it = by_path.get(p)
+        if it is None:
+            missing.append({"upload_id": up.id, "period_id": up.period_id, "kind": up.kind, "stored_path": up.stored_path})
+            continue
+        it["upload_id"] = up.id
+        if up.sha256 and it["sha256"] and up.sha256 != it["sha256"]:
+            mismatched.append({"upload_id": up.id, "path": it["path"], "expected": up.sha256, "actual": it["sha256"]})
+    orphaned = [it["path"] for it in items
+                if it["abs_path"].startswith(upload_root + os.sep) and it["abs_path"] not in referenced]
+
+    report = {
+        "run_id": datetime.now().strftime("%Y%m%d_%H%M%S"),
+        "target": target,
+        "roots": roots,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "total_files": len(items),
+        "total_size_bytes": sum(it["size"] for it in items),
+        "rehashed_files": len(to_hash),
+        "orphaned_files": orphaned,
+        "missing_files": missing,
+        "hash_mismatches": mismatched,
+        "items": items,
+    }
+    write_reports(report, out_dir)
+    return report
+
+def write_reports(report: dict, out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, REPORT_NAME)
+    writers = {".json": _write_json, ".csv": _write_csv, ".md": _write_md, ".html": _write_html}
+    for ext, write in writers.items():
+        tmp = f"{base}{ext}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            write(report, f)
+        os.replace(tmp, base + ext)
+
+def _write_json(report, f):
+    json.dump(report, f, ensure_ascii=False, indent=2)
+
+def _write_csv(report, f):
+    w = csv.writer(f)
+    w.writerow(["path", "size", "mtime", "ext", "sha256", "upload_id"])
+    for it in report["items"]:
+        w.writerow([it["path"], it["size"], it["mtime"], it["ext"], it["sha256"] or "", it["upload_id"] or ""])
+
+def _write_md(report, f):
+    lines = [
+        "# Klasör Tarama Raporu",
+        "",
+        f"- Run: `{report['run_id']}`",
+        f"- Hedef: `{report['target']}`",
+        f"- Dosya: **{report['total_files']}** | Toplam boyut: **{report['total_size_bytes']} bytes**"
+        f" | Yeniden hash: **{report['rehashed_files']}**",
+        f"- Sahipsiz dosya: **{len(report['orphaned_files'])}** | Eksik dosya: **{len(report['missing_files'])}**"
+        f" | Hash uyuşmazlığı: **{len(report['hash_mismatches'])}**",
+        "",
+    ]
+    if report["orphaned_files"]:
+        lines += ["## Sahipsiz dosyalar (Upload kaydı yok)", ""] + [f"- `{p}`" for p in report["orphaned_files"]] + [""]
+    if report["missing_files"]:
+        lines += ["## Eksik dosyalar (stored_path bulunamadı)", ""]
+        lines += [f"- Upload #{m['upload_id']} ({m['kind']}): `{m['stored_path']}`" for m in report["missing_files"]] + [""]
+    if report["hash_mismatches"]:
+        lines += ["## Hash uyuşmazlıkları", ""]
+        lines += [f"- Upload #{m['upload_id']}: `{m['path']}`" for m in report["hash_mismatches"]] + [""]
+    lines += [f"## İlk {REPORT_LIMIT} dosya", "", "| Path | Size | Ext | Upload |", "|---|---:|---|---:|"]
+    for it in report["items"][:REPORT_LIMIT]:
+        lines.append(f"| `{it['path']}` | {it['size']} | `{it['ext']}` | {it['upload_id'] or ''} |")
+    f.write("\n".join(lines) + "\n")
+
+def _write_html(report, f):
+    f.write("<html><head><meta charset='utf-8'><title>Folder Scan</title></head><body>\n")
+    f.write(f"<h1>Klasör Tarama Raporu</h1><p><b>Run:</b> {escape(report['run_id'])}<br>"
+            f"<b>Hedef:</b> {escape(report['target'])}<br><b>Dosya:</b> {report['total_files']}<br>"
+            f"<b>Boyut:</b> {report['total_size_bytes']} bytes<br>"
+            f"<b>Sahipsiz:</b> {len(report['orphaned_files'])}<br><b>Eksik:</b> {len(report['missing_files'])}<br>"
+            f"<b>Hash uyuşmazlığı:</b> {len(report['hash_mismatches'])}</p>\n")
+    if report["orphaned_files"]:
+        f.write("<h2>Sahipsiz dosyalar</h2><ul>\n")
+        f.writelines(f"<li>{escape(p)}</li>\n" for p in report["orphaned_files"])
+        f.write("</ul>\n")
+    if report["missing_files"]:
+        f.write("<h2>Eksik dosyalar</h2><ul>\n")
+        f.writelines(f"<li>Upload #{m['upload_id']} ({escape(m['kind'] or '')}): {escape(m['stored_path'])}</li>\n"
+                     for m in report["missing_files"])
+        f.write("</ul>\n")
+    f.write(f"<h2>İlk {REPORT_LIMIT} dosya</h2><table border='1' cellspacing='0' cellpadding='4'>"
+            "<tr><th>Path</th><th>Size</th><th>Ext</th><th>Upload</th></tr>\n")
+    for it in report["items"][:REPORT_LIMIT]:
+        f.write(f"<tr><td>{escape(it['path'])}</td><td align='right'>{it['size']}</td>"
+                f"<td>{escape(it['ext'])}</td><td align='right'>{it['upload_id'] or ''}</td></tr>\n")
+    f.write("</table></body></html>")
+
+def summary(report: dict) -> dict:
+    return {k: v for k, v in report.items() if k != "items"}
+
+def main(argv: List[str]) -> int:
+    from .db import SessionLocal
+    from .config import UPLOAD_DIR, EXPORT_DIR, SCAN_REPORT_DIR
+
+    out_dir = argv[argv.index("--out") + 1] if "--out" in argv else SCAN_REPORT_DIR
+    workers = int(argv[argv.index("--workers") + 1]) if "--workers" in argv else HASH_WORKERS
+    with SessionLocal() as db:
+        report = scan(db, UPLOAD_DIR, [UPLOAD_DIR, EXPORT_DIR], out_dir, workers=workers)
+    s = summary(report)
+    print(f"{s['total_files']} files, {s['rehashed_files']} rehashed, "
+          f"{len(s['orphaned_files'])} orphaned, {len(s['missing_files'])} missing, "
+          f"{len(s['hash_mismatches'])} mismatched -> {out_dir}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
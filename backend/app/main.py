@@ -1,29 +1,45 @@
 import os
+import time
+import uuid
+import shutil
+import hashlib
+import threading
 from datetime import date, datetime
 from fastapi import FastAPI, Request, Form, UploadFile, File, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, PlainTextResponse, Response, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from .db import SessionLocal, engine, Base
+from .config import (APP_SECRET_KEY, UPLOAD_DIR, EXPORT_DIR, AUDIT_PACK_DIR, SCAN_REPORT_DIR,
+                     TEMPLATE_PATH, JINJA_CACHE_DIR, CN_INDEX_PATH)
+from .db import SessionLocal, engine
 from .models import User, Period, Energy, Product, Upload
-from .auth import hash_password, verify_password, sign_session, current_user_id
+from .auth import verify_password, sign_session, current_user_id
+from .bootstrap import bootstrap
+from .evidence_index import scan as scan_evidence, summary as scan_summary, REPORT_NAME as SCAN_REPORT_NAME
+from .migrations import run_backfills_once, backfill_status, current_version, LATEST_VERSION
 from .invoice_parse import extract_text_from_pdf, guess_energy_from_text
 from .cbam_excel import fill_cbam_template
-from .pdf_report import build_pdf
-
-APP_SECRET_KEY = os.getenv("APP_SECRET_KEY", "change-me")
-UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/app/data/uploads")
-TEMPLATE_PATH = os.getenv("CBAM_TEMPLATE_PATH", "/app/data/templates/cbam_template.xlsx")
+from .pdf_report import build_pdf, build_pack_index
+from .product_rows import iter_product_rows
+from .audit_pack import build_audit_pack, pack_key, ordered_uploads, cached_pack_path, touch_pack, prune_packs
+from .cn_codes import CNIndex, load_cn_index
+from .versioning import take_snapshot, diff_versions, get_version, diff_to_markdown
+from .rendering import make_templates, templates_version, FragmentCache, make_etag, etag_matches
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-Base.metadata.create_all(bind=engine)
+os.makedirs(EXPORT_DIR, exist_ok=True)
+os.makedirs(AUDIT_PACK_DIR, exist_ok=True)
 
 app = FastAPI(title="ISOTEC CBAM Platform (MVP)")
 app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
-templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+templates = make_templates(TEMPLATES_DIR, JINJA_CACHE_DIR)
+TEMPLATES_VERSION = templates_version(TEMPLATES_DIR)
+fragments = FragmentCache()
+_ready = False
+cn_index = CNIndex([])
 
 def get_db():
     db = SessionLocal()
@@ -41,22 +57,102 @@ def require_user(request: Request, db: Session) -> User:
         raise HTTPException(status_code=401)
     return user
 
-def seed_admin(db: Session):
-    admin = db.query(User).filter(User.email == "admin@isotec.local").first()
-    if not admin:
-        admin = User(
-            email="admin@isotec.local",
-            password_hash=hash_password("ChangeMe123!"),
-            full_name="Admin",
-            role="admin",
-        )
-        db.add(admin)
-        db.commit()
-
 @app.on_event("startup")
 def _startup():
-    with SessionLocal() as db:
-        seed_admin(db)
+    global cn_index, _ready
+    bootstrap()
+    cn_index = load_cn_index(TEMPLATE_PATH, CN_INDEX_PATH)
+    _sweep_stale_tmp(EXPORT_DIR)
+    # data backfills run in small batches while serving; only one worker takes the lock
+    threading.Thread(target=run_backfills_once, name="backfills", daemon=True).start()
+    _ready = True
+
+# older than any export or download can take; only leftovers of killed workers are this old
+STALE_TMP_S = 3600
+
+def _tmp_path(out_path: str) -> str:
+    return f"{out_path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+def _atomic_export(out_path: str, write) -> str:
+    """Write to a worker-unique temp file, then rename into place; readers never see partial files."""
+    tmp = _tmp_path(out_path)
+    try:
+        write(tmp)
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return out_path
+
+def _export_response(out_path: str, write) -> FileResponse:
+    """Build the export into a worker-unique file and serve that file, deleting it once sent.
+
+    The shared ``out_path`` (what the evidence index sees) is swapped in as a hard link to
+    the same bytes; another worker replacing it mid-download cannot change this response.
+    """
+    tmp = _tmp_path(out_path)
+    try:
+        write(tmp)
+        _atomic_export(out_path, lambda link: os.link(tmp, link))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return _TempFileResponse(tmp, filename=os.path.basename(out_path))
+
+class _TempFileResponse(FileResponse):
+    """FileResponse that deletes its file once the response ends, also when the client hangs up.
+
+    (A ``BackgroundTask`` would not do: Starlette skips it when sending fails.)
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+def _sweep_stale_tmp(root: str, max_age_s: int = STALE_TMP_S):
+    """Remove export temp files (and audit pack work dirs) left behind by killed workers."""
+    cutoff = time.time() - max_age_s
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            if not (name.endswith(".tmp") or name.endswith(".tmp.parts")):
+                continue
+            p = os.path.join(dirpath, name)
+            try:
+                if os.path.getmtime(p) >= cutoff:
+                    continue
+                if os.path.isdir(p):
+                    shutil.rmtree(p, ignore_errors=True)
+                else:
+                    os.remove(p)
+            except OSError:
+                pass
+
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    problems = []
+    if not _ready:
+        problems.append("not started")
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        problems.append(f"db: {e.__class__.__name__}")
+    for d in (UPLOAD_DIR, EXPORT_DIR):
+        if not os.access(d, os.W_OK):
+            problems.append(f"not writable: {d}")
+    if problems:
+        return JSONResponse({"status": "unavailable", "problems": problems}, status_code=503)
+    return {"status": "ok"}
 
 @app.get("/", response_class=HTMLResponse)
 def root(request: Request, db: Session = Depends(get_db)):
@@ -85,6 +181,37 @@ def logout():
     resp.delete_cookie("session")
     return resp
 
+@app.get("/admin/migrations")
+def migrations_status(request: Request, db: Session = Depends(get_db)):
+    user = require_admin(request, db)
+    return {
+        "schema_version": current_version(db.connection()),
+        "latest_version": LATEST_VERSION,
+        "backfills": backfill_status(db),
+    }
+
+def require_admin(request: Request, db: Session) -> User:
+    user = require_user(request, db)
+    if user.role != "admin":
+        raise HTTPException(403)
+    return user
+
+@app.post("/admin/evidence/scan")
+def evidence_scan(request: Request, db: Session = Depends(get_db)):
+    user = require_admin(request, db)
+    report = scan_evidence(db, UPLOAD_DIR, [UPLOAD_DIR, EXPORT_DIR], SCAN_REPORT_DIR)
+    return scan_summary(report)
+
+@app.get("/admin/evidence/report.{fmt}")
+def evidence_report(fmt: str, request: Request, db: Session = Depends(get_db)):
+    user = require_admin(request, db)
+    if fmt not in ("json", "csv", "html", "md"):
+        raise HTTPException(404)
+    path = os.path.join(SCAN_REPORT_DIR, f"{SCAN_REPORT_NAME}.{fmt}")
+    if not os.path.exists(path):
+        raise HTTPException(404, detail="Henüz tarama yapılmadı.")
+    return FileResponse(path, filename=os.path.basename(path))
+
 @app.get("/dashboard", response_class=HTMLResponse)
 def dashboard(request: Request, db: Session = Depends(get_db)):
     user = require_user(request, db)
@@ -120,9 +247,25 @@ def period_view(period_id: int, request: Request, db: Session = Depends(get_db))
     if not period:
         raise HTTPException(404)
     energy = period.energy
-    products = period.products
-    uploads = period.uploads
-    return templates.TemplateResponse("period.html", {"request": request, "user": user, "period": period, "energy": energy, "products": products, "uploads": uploads})
+
+    # period.rev moves on every write to the period or its rows; nothing is rendered
+    # (and the lists are not loaded) unless it changed
+    etag = make_etag(TEMPLATES_VERSION, user.id, period.id, period.rev)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    products_html = fragments.get_or_render(
+        ("products", TEMPLATES_VERSION, period_id, period.rev),
+        lambda: templates.get_template("_products_table.html").render(products=list(iter_product_rows(db, period_id))),
+    )
+    uploads_html = fragments.get_or_render(
+        ("uploads", TEMPLATES_VERSION, period_id, period.rev),
+        lambda: templates.get_template("_uploads_list.html").render(uploads=period.uploads),
+    )
+    return templates.TemplateResponse("period.html", {"request": request, "user": user, "period": period, "energy": energy,
+                                                      "products_html": products_html, "uploads_html": uploads_html},
+                                      headers=headers)
 
 @app.post("/period/{period_id}/installation")
 def update_installation(period_id: int, request: Request,
@@ -194,12 +337,29 @@ def add_product(period_id: int, request: Request,
     period = db.get(Period, period_id)
     if not period:
         raise HTTPException(404)
+    # validate against the template CN list and fill name/category from it
+    if len(cn_index):
+        entry = cn_index.lookup(cn_code)
+        if not entry:
+            raise HTTPException(status_code=400, detail=f"CN kodu CBAM listesinde yok: {cn_code}")
+        _, cn_code, name, category = entry
+        cn_name = cn_name or name
+        aggregated_category = aggregated_category or category
     p = Product(period_id=period.id, cn_code=cn_code, cn_name=cn_name, aggregated_category=aggregated_category,
                 product_name=product_name, production_t=production_t, direct_see=direct_see, indirect_see=indirect_see)
     db.add(p)
     db.commit()
     return RedirectResponse(f"/period/{period_id}#products", status_code=302)
 
+@app.get("/api/cn-codes")
+def cn_codes(request: Request, q: str = "", limit: int = 20, db: Session = Depends(get_db)):
+    user = require_user(request, db)
+    limit = max(1, min(limit, 100))
+    return [
+        {"cn_code": code, "cn_name": name, "aggregated_category": category}
+        for _, code, name, category in cn_index.prefix(q, limit)
+    ]
+
 @app.post("/period/{period_id}/upload")
 async def upload_file(period_id: int, request: Request,
                       kind: str = Form("evidence"),
@@ -213,12 +373,14 @@ async def upload_file(period_id: int, request: Request,
     # store
     safe_name = file.filename.replace("..","").replace("/","_").replace("\\","_")
     ts = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    stored = os.path.join(UPLOAD_DIR, f"{period_id}_{kind}_{ts}_{safe_name}")
+    # random suffix keeps same-second uploads from different workers apart
+    stored = os.path.join(UPLOAD_DIR, f"{period_id}_{kind}_{ts}_{uuid.uuid4().hex[:6]}_{safe_name}")
     content = await file.read()
     with open(stored, "wb") as f:
         f.write(content)
 
-    up = Upload(period_id=period_id, kind=kind, original_name=file.filename, stored_path=stored)
+    up = Upload(period_id=period_id, kind=kind, original_name=file.filename, stored_path=stored,
+                sha256=hashlib.sha256(content).hexdigest(), size_bytes=len(content))
     db.add(up)
     db.commit()
 
@@ -243,13 +405,10 @@ def export_excel(period_id: int, request: Request, db: Session = Depends(get_db)
     period = db.get(Period, period_id)
     if not period:
         raise HTTPException(404)
-    products = period.products
+    take_snapshot(db, period, trigger="export-excel")
 
-    out_dir = "/app/data/exports"
-    os.makedirs(out_dir, exist_ok=True)
-    out_path = os.path.join(out_dir, f"ISOTEC_CBAM_{period.year}_Q{period.quarter}.xlsx")
-    fill_cbam_template(TEMPLATE_PATH, period, products, out_path)
-    return FileResponse(out_path, filename=os.path.basename(out_path))
+    out_path = os.path.join(EXPORT_DIR, f"ISOTEC_CBAM_{period.year}_Q{period.quarter}.xlsx")
+    return _export_response(out_path, lambda tmp: fill_cbam_template(TEMPLATE_PATH, period, iter_product_rows(db, period_id), tmp))
 
 @app.get("/period/{period_id}/export/pdf")
 def export_pdf(period_id: int, request: Request, db: Session = Depends(get_db)):
@@ -257,11 +416,67 @@ def export_pdf(period_id: int, request: Request, db: Session = Depends(get_db)):
     period = db.get(Period, period_id)
     if not period:
         raise HTTPException(404)
-    products = period.products
+    take_snapshot(db, period, trigger="export-pdf")
     energy = period.energy
 
-    out_dir = "/app/data/exports"
-    os.makedirs(out_dir, exist_ok=True)
-    out_path = os.path.join(out_dir, f"ISOTEC_CBAM_{period.year}_Q{period.quarter}.pdf")
-    build_pdf(out_path, period, products, energy)
-    return FileResponse(out_path, filename=os.path.basename(out_path))
+    out_path = os.path.join(EXPORT_DIR, f"ISOTEC_CBAM_{period.year}_Q{period.quarter}.pdf")
+    return _export_response(out_path, lambda tmp: build_pdf(tmp, period, iter_product_rows(db, period_id), energy))
+
+@app.get("/period/{period_id}/export/audit-pack")
+def export_audit_pack(period_id: int, request: Request, db: Session = Depends(get_db)):
+    user = require_user(request, db)
+    period = db.get(Period, period_id)
+    if not period:
+        raise HTTPException(404)
+    version = take_snapshot(db, period, trigger="export-audit-pack")
+    uploads = ordered_uploads(period.uploads)
+
+    # same report data + same invoice bytes -> reuse the pack built earlier
+    out_path = cached_pack_path(AUDIT_PACK_DIR, period_id, pack_key(version, uploads))
+    if not touch_pack(out_path):
+        _atomic_export(out_path, lambda tmp: build_audit_pack(
+            tmp, period, uploads,
+            build_report=lambda p: build_pdf(p, period, iter_product_rows(db, period_id), period.energy),
+            build_index=build_pack_index,
+        ))
+        prune_packs(AUDIT_PACK_DIR, period_id, keep=out_path)
+    return FileResponse(out_path, filename=f"ISOTEC_CBAM_{period.year}_Q{period.quarter}_audit_pack.pdf")
+
+@app.get("/upload/{upload_id}/download")
+def download_upload(upload_id: int, request: Request, db: Session = Depends(get_db)):
+    user = require_user(request, db)
+    up = db.get(Upload, upload_id)
+    if not up or not os.path.exists(up.stored_path):
+        raise HTTPException(404)
+    return FileResponse(up.stored_path, filename=up.original_name)
+
+@app.get("/period/{period_id}/versions")
+def list_versions(period_id: int, request: Request, db: Session = Depends(get_db)):
+    user = require_user(request, db)
+    period = db.get(Period, period_id)
+    if not period:
+        raise HTTPException(404)
+    return [
+        {"version_no": v.version_no, "trigger": v.trigger, "created_at": v.created_at.isoformat()}
+        for v in period.versions
+    ]
+
+@app.get("/period/{period_id}/diff")
+def period_diff(period_id: int, request: Request,
+                a: str = "latest",
+                b: str = "current",
+                format: str = "json",
+                db: Session = Depends(get_db)):
+    user = require_user(request, db)
+    period = db.get(Period, period_id)
+    if not period:
+        raise HTTPException(404)
+    try:
+        va = get_version(db, period_id, a)
+        vb = get_version(db, period_id, b)
+    except (LookupError, ValueError):
+        raise HTTPException(404, detail="Versiyon bulunamadı.")
+    d = diff_versions(db, period, va, vb)
+    if format == "md":
+        return PlainTextResponse(diff_to_markdown(period, d), media_type="text/markdown; charset=utf-8")
+    return d
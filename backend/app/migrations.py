@@ -0,0 +1,239 @@
+"""Versioned schema migrations and resumable, batched data backfills.
+
+Schema steps are short DDL and run once under the bootstrap lock. Backfills touch
+existing rows in small batches, so they can run in the background while the app
+serves and resume after a restart. Each batch is read and computed (e.g. files
+hashed) outside any write transaction; only its UPDATEs and the saved cursor are
+written, together, in one short transaction.
+
+    python -m app.migrations status
+    python -m app.migrations run [--batch-size N]
+"""
+import os
+import sys
+import time
+import fcntl
+import hashlib
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .db import Base, SessionLocal, DB_PATH
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "200"))
+BATCH_PAUSE_S = float(os.getenv("MIGRATION_BATCH_PAUSE", "0.05"))
+BACKFILL_LOCK_PATH = os.getenv("BACKFILL_LOCK_PATH", os.path.join(os.path.dirname(DB_PATH), ".backfill.lock"))
+
+# ---------------------------------------------------------------- schema steps
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.exec_driver_sql(f"PRAGMA table_info({table})"))
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str):
+    # fresh databases already get the column from the baseline create_all
+    if not _has_column(conn, table, column):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+def _baseline(conn: Connection):
+    from . import models  # noqa: F401  (register tables on Base.metadata)
+    Base.metadata.create_all(bind=conn)
+
+def _period_indexes(conn: Connection):
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_products_period_id ON products (period_id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_uploads_period_id ON uploads (period_id)")
+
+def _upload_hash_columns(conn: Connection):
+    _add_column(conn, "uploads", "sha256", "VARCHAR(64)")
+    _add_column(conn, "uploads", "size_bytes", "INTEGER")
+
+def _period_version_unique(conn: Connection):
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_period_versions_period_version ON period_versions (period_id, version_no)"
+    )
+
+def _period_rev(conn: Connection):
+    _add_column(conn, "periods", "rev", "INTEGER NOT NULL DEFAULT 0")
+
+SCHEMA_MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline", _baseline),
+    (2, "index products/uploads by period", _period_indexes),
+    (3, "uploads sha256 + size_bytes", _upload_hash_columns),
+    (4, "unique (period_id, version_no) on period_versions", _period_version_unique),
+    (5, "periods.rev change counter", _period_rev),
+]
+LATEST_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+def _ensure_bookkeeping(conn: Connection):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at VARCHAR NOT NULL)"
+    )
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS backfill_progress ("
+        "name VARCHAR PRIMARY KEY, last_id INTEGER NOT NULL DEFAULT 0, rows_done INTEGER NOT NULL DEFAULT 0, "
+        "total INTEGER, done INTEGER NOT NULL DEFAULT 0, updated_at VARCHAR)"
+    )
+
+def current_version(conn: Connection) -> int:
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_migrations'"
+    ).first()
+    if not exists:
+        return 0
+    return conn.exec_driver_sql("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").scalar()
+
+def migrate_schema(engine: Engine) -> int:
+    """Apply pending schema steps; a single version query when already up to date."""
+    with engine.connect() as conn:
+        if current_version(conn) >= LATEST_VERSION:
+            return 0
+    applied = 0
+    with engine.begin() as conn:
+        _ensure_bookkeeping(conn)
+        version = current_version(conn)
+        for v, name, up in SCHEMA_MIGRATIONS:
+            if v <= version:
+                continue
+            log.info("migration %d: %s", v, name)
+            up(conn)
+            conn.execute(text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                         {"v": v, "n": name, "t": datetime.utcnow().isoformat()})
+            applied += 1
+    return applied
+
+# ---------------------------------------------------------------- data backfills
+
+def _file_digest(path: str) -> Tuple[Optional[str], Optional[int]]:
+    try:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest(), os.path.getsize(path)
+    except OSError:
+        return None, None
+
+def _select_unhashed_uploads(db: Session, after_id: int, limit: int) -> list:
+    return db.execute(
+        text("SELECT id, stored_path FROM uploads WHERE id > :after AND sha256 IS NULL ORDER BY id LIMIT :n"),
+        {"after": after_id, "n": limit},
+    ).all()
+
+def _hash_uploads(rows: list) -> List[dict]:
+    out = []
+    for upload_id, stored_path in rows:
+        digest, size = _file_digest(stored_path)
+        out.append({"h": digest, "s": size, "id": upload_id})
+    return out
+
+def _count_upload_hashes(db: Session) -> int:
+    return db.execute(text("SELECT COUNT(*) FROM uploads WHERE sha256 IS NULL")).scalar()
+
+class Backfill(NamedTuple):
+    select: Callable[[Session, int, int], list]    # (db, after_id, limit) -> rows, first column is the id
+    compute: Callable[[list], List[dict]]          # rows -> UPDATE parameters; runs with no transaction open
+    update: str                                    # UPDATE statement, executed once per parameter dict
+    count: Callable[[Session], int]                # rows still to do
+
+BACKFILLS = {
+    "uploads_sha256": Backfill(
+        _select_unhashed_uploads, _hash_uploads,
+        "UPDATE uploads SET sha256 = :h, size_bytes = :s WHERE id = :id",
+        _count_upload_hashes,
+    ),
+}
+
+def backfill_status(db: Session) -> List[dict]:
+    rows = {r.name: r for r in db.execute(text("SELECT * FROM backfill_progress")).all()}
+    out = []
+    for name in BACKFILLS:
+        r = rows.get(name)
+        out.append({
+            "name": name,
+            "rows_done": r.rows_done if r else 0,
+            "total": r.total if r else None,
+            "done": bool(r.done) if r else False,
+            "updated_at": r.updated_at if r else None,
+        })
+    return out
+
+def run_backfills(batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE_S, progress: Callable[[str, int, Optional[int]], None] = None):
+    """Run every unfinished backfill to completion, one committed batch at a time."""
+    for name, bf in BACKFILLS.items():
+        with SessionLocal() as db:
+            db.execute(text("INSERT OR IGNORE INTO backfill_progress (name) VALUES (:n)"), {"n": name})
+            row = db.execute(text("SELECT last_id, rows_done, total, done FROM backfill_progress WHERE name = :n"),
+                             {"n": name}).one()
+            if row.done:
+                db.commit()
+                continue
+            last_id, rows_done, total = row.last_id, row.rows_done, row.total
+            if total is None:
+                total = rows_done + bf.count(db)
+                db.execute(text("UPDATE backfill_progress SET total = :t WHERE name = :n"), {"t": total, "n": name})
+            db.commit()
+
+            while True:
+                rows = bf.select(db, last_id, batch_size)
+                db.commit()  # end the read before the slow part; nothing is locked while computing
+                params = bf.compute(rows)
+                n = len(rows)
+                if rows:
+                    last_id = rows[-1][0]
+                    rows_done += n
+                    db.execute(text(bf.update), params)
+                db.execute(
+                    text("UPDATE backfill_progress SET last_id = :l, rows_done = :r, done = :d, updated_at = :t WHERE name = :n"),
+                    {"l": last_id, "r": rows_done, "d": int(n < batch_size), "t": datetime.utcnow().isoformat(), "n": name},
+                )
+                db.commit()
+                if progress:
+                    progress(name, rows_done, total)
+                if n < batch_size:
+                    break
+                time.sleep(pause)
+
+def run_backfills_once(**kwargs) -> bool:
+    """Run backfills unless another worker already is; returns False if the lock was taken."""
+    os.makedirs(os.path.dirname(BACKFILL_LOCK_PATH) or ".", exist_ok=True)
+    with open(BACKFILL_LOCK_PATH, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            run_backfills(**kwargs)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return True
+
+def _print_progress(name: str, done: int, total: Optional[int]):
+    print(f"{name}: {done}/{total if total is not None else '?'}", flush=True)
+
+def main(argv: List[str]) -> int:
+    from .bootstrap import bootstrap
+    from .db import engine
+
+    cmd = argv[0] if argv else "status"
+    if cmd == "run":
+        batch_size = int(argv[argv.index("--batch-size") + 1]) if "--batch-size" in argv else BATCH_SIZE
+        bootstrap()
+        if not run_backfills_once(batch_size=batch_size, progress=_print_progress):
+            print("another process is running backfills")
+            return 1
+    with engine.connect() as conn:
+        print(f"schema version: {current_version(conn)}/{LATEST_VERSION}")
+    with SessionLocal() as db:
+        if current_version(db.connection()) >= 1:
+            for s in backfill_status(db):
+                _print_progress(s["name"], s["rows_done"], s["total"])
+                print(f"  done={s['done']} updated_at={s['updated_at']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
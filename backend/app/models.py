@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Float, ForeignKey, Text, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, ForeignKey, Text, Boolean, Index
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, Session
 from datetime import datetime
 from .db import Base
 
@@ -40,10 +41,12 @@ class Period(Base):
     quality_assurance = Column(Text, default="")
 
     created_at = Column(DateTime, default=datetime.utcnow)
+    rev = Column(Integer, nullable=False, default=0)  # bumped on every change to the period or its rows
 
     energy = relationship("Energy", back_populates="period", uselist=False, cascade="all, delete-orphan")
     products = relationship("Product", back_populates="period", cascade="all, delete-orphan")
     uploads = relationship("Upload", back_populates="period", cascade="all, delete-orphan")
+    versions = relationship("PeriodVersion", back_populates="period", cascade="all, delete-orphan", order_by="PeriodVersion.version_no")
 
 class Energy(Base):
     __tablename__ = "energy"
@@ -61,7 +64,7 @@ class Energy(Base):
 class Product(Base):
     __tablename__ = "products"
     id = Column(Integer, primary_key=True)
-    period_id = Column(Integer, ForeignKey("periods.id"), nullable=False)
+    period_id = Column(Integer, ForeignKey("periods.id"), nullable=False, index=True)
     cn_code = Column(String, nullable=False)
     cn_name = Column(String, default="")
     aggregated_category = Column(String, default="")  # Iron or steel products / Aluminium products / ...
@@ -75,10 +78,56 @@ class Product(Base):
 class Upload(Base):
     __tablename__ = "uploads"
     id = Column(Integer, primary_key=True)
-    period_id = Column(Integer, ForeignKey("periods.id"), nullable=False)
+    period_id = Column(Integer, ForeignKey("periods.id"), nullable=False, index=True)
     kind = Column(String, default="evidence")  # electricity | gas | evidence
     original_name = Column(String, nullable=False)
     stored_path = Column(String, nullable=False)
+    sha256 = Column(String(64), nullable=True)  # filled on upload; backfilled for older rows
+    size_bytes = Column(Integer, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
 
     period = relationship("Period", back_populates="uploads")
+
+class SnapshotBlob(Base):
+    """Content-addressed JSON payload; shared by every version that references it."""
+    __tablename__ = "snapshot_blobs"
+    hash = Column(String(64), primary_key=True)  # sha256 of data
+    data = Column(Text, nullable=False)
+
+class PeriodVersion(Base):
+    __tablename__ = "period_versions"
+    id = Column(Integer, primary_key=True)
+    period_id = Column(Integer, ForeignKey("periods.id"), nullable=False, index=True)
+    version_no = Column(Integer, nullable=False)
+    trigger = Column(String, default="export")  # export-excel | export-pdf
+    installation_hash = Column(String(64), ForeignKey("snapshot_blobs.hash"), nullable=False)
+    energy_hash = Column(String(64), ForeignKey("snapshot_blobs.hash"), nullable=False)
+    products_hash = Column(String(64), ForeignKey("snapshot_blobs.hash"), nullable=False)  # {"buckets": {n: bucket hash}}
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    period = relationship("Period", back_populates="versions")
+
+    # concurrent exports of one period must not both claim the same version number
+    __table_args__ = (Index("uq_period_versions_period_version", "period_id", "version_no", unique=True),)
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_period_rev(session, flush_context, instances):
+    """Bump ``Period.rev`` whenever the period or one of its energy/product/upload rows changes.
+
+    Page caches and ETags are keyed by ``rev``, so this has to cover every write path,
+    including ones added later; doing it at flush time means no endpoint can forget it.
+    """
+    period_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Period):
+            if obj not in session.new:
+                period_ids.add(obj.id)
+        elif isinstance(obj, (Energy, Product, Upload)) and obj.period_id is not None:
+            period_ids.add(obj.period_id)
+    for pid in period_ids:
+        period = session.get(Period, pid)
+        if period is not None:
+            period.rev = Period.rev + 1
@@ -2,10 +2,12 @@ from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
 from datetime import datetime
-from .models import Period, Product, Energy
-from typing import List, Optional
+from itertools import islice
+from .models import Period, Energy
+from .product_rows import ProductRow
+from typing import Iterable, List, Optional
 
-def build_pdf(out_path: str, period: Period, products: List[Product], energy: Optional[Energy]) -> str:
+def build_pdf(out_path: str, period: Period, products: Iterable[ProductRow], energy: Optional[Energy]) -> str:
     c = canvas.Canvas(out_path, pagesize=A4)
     w, h = A4
 
@@ -57,7 +59,7 @@ def build_pdf(out_path: str, period: Period, products: List[Product], energy: Op
     total_s1=0.0
     total_s2=0.0
     total_s3=0.0
-    for p in products[:12]:
+    for p in islice(products, 12):
         total = (p.direct_see or 0) + (p.indirect_see or 0)
         c.drawString(colx[0], y, p.cn_code)
         c.drawString(colx[1], y, (p.product_name or "")[:35])
@@ -86,3 +88,41 @@ def build_pdf(out_path: str, period: Period, products: List[Product], energy: Op
     c.showPage()
     c.save()
     return out_path
+
+def build_pack_index(out_path: str, period: Period, report_pages: int, entries: List[dict]) -> str:
+    """Index page of the audit pack: one line per upload with its start page (or why it was skipped)."""
+    c = canvas.Canvas(out_path, pagesize=A4)
+    w, h = A4
+
+    def header():
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(20*mm, h-25*mm, f"EK DİZİNİ (AUDIT PACK) - {period.year}-Q{period.quarter}")
+        c.setFont("Helvetica", 9)
+        c.drawString(20*mm, h-31*mm, f"CBAM raporu: sayfa 1-{report_pages}")
+        c.line(20*mm, h-34*mm, w-20*mm, h-34*mm)
+        return h-42*mm
+
+    y = header()
+    kind = None
+    for e in entries:
+        if y < 25*mm:
+            c.showPage()
+            y = header()
+        if e["kind_title"] != kind:
+            kind = e["kind_title"]
+            c.setFont("Helvetica-Bold", 10)
+            c.drawString(20*mm, y, kind)
+            y -= 6*mm
+        c.setFont("Helvetica", 8)
+        c.drawString(24*mm, y, (e["name"] or "")[:70])
+        if e["start_page"]:
+            c.drawRightString(w-20*mm, y, f"s. {e['start_page']} ({e['pages']} sayfa)")
+        else:
+            c.drawRightString(w-20*mm, y, e["note"])
+        y -= 4*mm
+        c.setFont("Helvetica", 6)
+        c.drawString(24*mm, y, f"sha256: {e['sha256'] or '-'}")
+        y -= 5*mm
+    c.showPage()
+    c.save()
+    return out_path
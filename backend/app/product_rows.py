@@ -0,0 +1,26 @@
+from typing import Iterator, NamedTuple, Optional
+from sqlalchemy.orm import Session
+
+from .models import Product
+
+class ProductRow(NamedTuple):
+    """Plain read-only product line; what the export paths need without ORM/identity-map overhead."""
+    id: int
+    cn_code: str
+    cn_name: Optional[str]
+    aggregated_category: Optional[str]
+    product_name: str
+    production_t: Optional[float]
+    direct_see: Optional[float]
+    indirect_see: Optional[float]
+
+_COLUMNS = [getattr(Product, f) for f in ProductRow._fields]
+
+def iter_product_rows(db: Session, period_id: int, batch_size: int = 1000) -> Iterator[ProductRow]:
+    """Stream a period's products as ``ProductRow`` tuples, fetched ``batch_size`` rows at a time."""
+    q = (db.query(*_COLUMNS)
+           .filter(Product.period_id == period_id)
+           .order_by(Product.id)
+           .yield_per(batch_size))
+    for r in q:
+        yield ProductRow._make(r)
@@ -0,0 +1,53 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+from fastapi import Request
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+def make_templates(directory: str, bytecode_cache_dir: str) -> Jinja2Templates:
+    """Jinja2Templates with compiled templates cached on disk, shared by all workers."""
+    os.makedirs(bytecode_cache_dir, exist_ok=True)
+    templates = Jinja2Templates(directory=directory)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+    return templates
+
+def templates_version(directory: str) -> str:
+    """Fingerprint of the template files; part of every ETag so a deploy invalidates clients."""
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        st = os.stat(os.path.join(directory, name))
+        h.update(f"{name}:{st.st_size}:{int(st.st_mtime)};".encode())
+    return h.hexdigest()[:12]
+
+class FragmentCache:
+    """Small thread-safe LRU of rendered HTML fragments."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Markup]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> Markup:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+        html = Markup(render())
+        with self._lock:
+            self._data[key] = html
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return html
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha1(repr(parts).encode("utf-8")).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    inm: Optional[str] = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    return etag in [t.strip().removeprefix("W/") for t in inm.split(",")] or inm.strip() == "*"
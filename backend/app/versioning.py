@@ -0,0 +1,241 @@
+import json
+import hashlib
+from datetime import date, datetime
+from typing import Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import Period, PeriodVersion, SnapshotBlob
+from .product_rows import iter_product_rows
+
+INSTALLATION_FIELDS = [
+    "start_date", "end_date",
+    "installation_name", "installation_name_en", "street_number", "economic_activity",
+    "post_code", "po_box", "city", "country", "unlocode", "latitude", "longitude",
+    "data_quality", "default_values_justification", "quality_assurance",
+]
+ENERGY_FIELDS = ["electricity_kwh", "natural_gas_sm3", "scope1_tco2e", "scope2_tco2e", "scope3_tco2e"]
+# products are grouped by id range; each bucket {product_id: hash} is its own blob and the
+# version's products_hash points at {"buckets": {n: bucket hash}}, so an unchanged range
+# is shared between versions and skipped by diffs
+BUCKET_SIZE = 256
+VERSION_RETRIES = 3
+PRODUCT_FIELDS = ["cn_code", "cn_name", "aggregated_category", "product_name", "production_t", "direct_see", "indirect_see"]
+
+def _value(v):
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    return v
+
+def _record(obj, fields) -> dict:
+    if obj is None:
+        return {}
+    return {f: _value(getattr(obj, f)) for f in fields}
+
+def _encode(data) -> Tuple[str, str]:
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest(), text
+
+class _Payloads(dict):
+    """Collects section payloads by content hash before anything is written."""
+
+    def put(self, data) -> str:
+        h, _ = _encode(data)
+        self[h] = data
+        return h
+
+class _Sections:
+    """Content hashes of one period state, plus which payloads belong to which bucket."""
+
+    def __init__(self, db: Session, period: Period):
+        self.payloads = _Payloads()
+        put = self.payloads.put
+        buckets = {}
+        for p in iter_product_rows(db, period.id):
+            buckets.setdefault(str(p.id // BUCKET_SIZE), {})[str(p.id)] = put(_record(p, PRODUCT_FIELDS))
+        self.buckets = {n: put(members) for n, members in buckets.items()}
+        self.installation = put(_record(period, INSTALLATION_FIELDS))
+        self.energy = put(_record(period.energy, ENERGY_FIELDS))
+        self.products = put({"buckets": self.buckets})
+
+    @property
+    def hashes(self) -> Tuple[str, str, str]:
+        return self.installation, self.energy, self.products
+
+    def new_payloads(self, known_buckets: dict) -> dict:
+        """Payloads a new version has to store: top-level sections and buckets that changed."""
+        out = {h: self.payloads[h] for h in (self.installation, self.energy, self.products)}
+        for n, bh in self.buckets.items():
+            if known_buckets.get(n) == bh:
+                continue
+            members = self.payloads[bh]
+            out[bh] = members
+            out.update((h, self.payloads[h]) for h in members.values())
+        return out
+
+def _load_blob(db: Session, h: str):
+    blob = db.get(SnapshotBlob, h)
+    return json.loads(blob.data) if blob else {}
+
+def _bucket_map(manifest: dict) -> dict:
+    if "buckets" in manifest:
+        return manifest["buckets"]
+    # versions written before bucketing stored a flat {product_id: hash}; regroup in memory
+    buckets = {}
+    for pid, h in manifest.items():
+        buckets.setdefault(str(int(pid) // BUCKET_SIZE), {})[pid] = h
+    return buckets
+
+def _store_blobs(db: Session, payloads: dict):
+    # OR IGNORE: another worker may store the same content concurrently
+    rows = [{"hash": h, "data": _encode(data)[1]} for h, data in payloads.items()]
+    for i in range(0, len(rows), 500):
+        db.execute(insert(SnapshotBlob).prefix_with("OR IGNORE"), rows[i:i + 500])
+
+def _last_version(db: Session, period_id: int) -> Optional[PeriodVersion]:
+    return (db.query(PeriodVersion)
+              .filter(PeriodVersion.period_id == period_id)
+              .order_by(PeriodVersion.version_no.desc())
+              .first())
+
+def take_snapshot(db: Session, period: Period, trigger: str = "export") -> PeriodVersion:
+    """Record an immutable version of the period; a no-op if nothing changed since the last one."""
+    sections = _Sections(db, period)
+    for attempt in range(VERSION_RETRIES):
+        last = _last_version(db, period.id)
+        if last and (last.installation_hash, last.energy_hash, last.products_hash) == sections.hashes:
+            return last
+        known = _bucket_map(_load_blob(db, last.products_hash)) if last else {}
+        known = {n: b for n, b in known.items() if isinstance(b, str)}
+        _store_blobs(db, sections.new_payloads(known))
+        v = PeriodVersion(
+            period_id=period.id,
+            version_no=(last.version_no + 1) if last else 1,
+            trigger=trigger,
+            installation_hash=sections.installation,
+            energy_hash=sections.energy,
+            products_hash=sections.products,
+        )
+        db.add(v)
+        try:
+            db.commit()
+            return v
+        except IntegrityError:
+            # a concurrent export took this version number; re-read and try again
+            db.rollback()
+            if attempt == VERSION_RETRIES - 1:
+                raise
+
+class _Side:
+    """One side of a diff: either a stored version or the live period state."""
+
+    def __init__(self, db: Session, period: Period, version: Optional[PeriodVersion]):
+        self.db = db
+        self.live = _Payloads()
+        if version is None:
+            sections = _Sections(db, period)
+            self.live = sections.payloads
+            inst_h, energy_h, products_h = sections.hashes
+        else:
+            inst_h, energy_h, products_h = version.installation_hash, version.energy_hash, version.products_hash
+        self.hashes = {"installation": inst_h, "energy": energy_h, "products": products_h}
+
+    def load(self, h):
+        if isinstance(h, dict):  # bucket regrouped from a pre-bucketing manifest
+            return h
+        if h in self.live:
+            return self.live[h]
+        return _load_blob(self.db, h)
+
+def _field_diff(old: dict, new: dict) -> dict:
+    return {k: [old.get(k), new.get(k)] for k in sorted(set(old) | set(new)) if old.get(k) != new.get(k)}
+
+def diff_versions(db: Session, period: Period, a: Optional[PeriodVersion], b: Optional[PeriodVersion]) -> dict:
+    """Field-level diff between two versions (None = current state).
+
+    Sections and product buckets whose content hash is equal are skipped without loading
+    their payloads; only the small bucket manifests are always compared.
+    """
+    left, right = _Side(db, period, a), _Side(db, period, b)
+    out = {
+        "from": a.version_no if a else "current",
+        "to": b.version_no if b else "current",
+        "installation": {},
+        "energy": {},
+        "products": {"added": {}, "removed": {}, "changed": {}},
+    }
+    for section in ("installation", "energy"):
+        if left.hashes[section] != right.hashes[section]:
+            out[section] = _field_diff(left.load(left.hashes[section]), right.load(right.hashes[section]))
+
+    if left.hashes["products"] != right.hashes["products"]:
+        lb = _bucket_map(left.load(left.hashes["products"]))
+        rb = _bucket_map(right.load(right.hashes["products"]))
+        for n in set(lb) | set(rb):
+            if lb.get(n) == rb.get(n):
+                continue
+            lm = left.load(lb[n]) if n in lb else {}
+            rm = right.load(rb[n]) if n in rb else {}
+            for pid, h in rm.items():
+                if pid not in lm:
+                    out["products"]["added"][pid] = right.load(h)
+                elif lm[pid] != h:
+                    out["products"]["changed"][pid] = _field_diff(left.load(lm[pid]), right.load(h))
+            for pid, h in lm.items():
+                if pid not in rm:
+                    out["products"]["removed"][pid] = left.load(h)
+    return out
+
+def get_version(db: Session, period_id: int, ref: str) -> Optional[PeriodVersion]:
+    """Resolve a version reference: a version number, "latest" or "current" (returns None).
+
+    "latest" on a period that was never exported also resolves to the current state, so
+    "latest vs current" is an empty diff rather than a 404.
+    """
+    q = db.query(PeriodVersion).filter(PeriodVersion.period_id == period_id)
+    if ref == "current":
+        return None
+    if ref == "latest":
+        return q.order_by(PeriodVersion.version_no.desc()).first()
+    v = q.filter(PeriodVersion.version_no == int(ref)).first()
+    if v is None:
+        raise LookupError(ref)
+    return v
+
+def _label(ref) -> str:
+    return ref if ref == "current" else f"v{ref}"
+
+def diff_to_markdown(period: Period, d: dict) -> str:
+    lines = [
+        "# Diff Raporu",
+        "",
+        f"- Dönem: `{period.year}-Q{period.quarter}`",
+        f"- Karşılaştırma: `{_label(d['from'])}` → `{_label(d['to'])}`",
+        "",
+    ]
+    changes = 0
+    for section, title in (("installation", "Tesis Bilgileri"), ("energy", "Enerji")):
+        if d[section]:
+            lines += [f"## {title}", "", "| Alan | Önce | Sonra |", "|---|---|---|"]
+            lines += [f"| `{k}` | {old} | {new} |" for k, (old, new) in d[section].items()]
+            lines.append("")
+            changes += len(d[section])
+    prods = d["products"]
+    if prods["added"] or prods["removed"] or prods["changed"]:
+        lines += ["## Ürünler", ""]
+        for pid, rec in prods["added"].items():
+            lines.append(f"- Eklendi #{pid}: `{rec.get('cn_code')}` {rec.get('product_name')}")
+        for pid, rec in prods["removed"].items():
+            lines.append(f"- Silindi #{pid}: `{rec.get('cn_code')}` {rec.get('product_name')}")
+        for pid, fields in prods["changed"].items():
+            for k, (old, new) in fields.items():
+                lines.append(f"- Değişti #{pid} `{k}`: {old} → {new}")
+        lines.append("")
+        changes += len(prods["added"]) + len(prods["removed"]) + len(prods["changed"])
+    if not changes:
+        if d["from"] == d["to"] == "current":
+            lines.append("(Henüz rapor alınmadı; karşılaştırılacak bir versiyon yok.)")
+        else:
+            lines.append("(Değişiklik yok.)")
+    return "\n".join(lines) + "\n"
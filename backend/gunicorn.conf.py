@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for the production serving mode.
+
+Usage (inside the container)::
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The worker count follows the CPU count unless ``WEB_CONCURRENCY`` is set.
+The schema/seed bootstrap runs once in the master before any worker forks;
+workers repeat it under the same file lock, so it is also safe when several
+replicas share the data volume.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# recycle workers periodically to cap memory growth from large exports
+max_requests = int(os.getenv("MAX_REQUESTS", "1000"))
+max_requests_jitter = 100
+accesslog = "-"
+
+
+def on_starting(server):
+    from app.bootstrap import bootstrap
+    from app.db import engine
+
+    bootstrap()
+    # drop the master's pooled SQLite connections so no worker inherits them across fork
+    engine.dispose()